@@ -0,0 +1,113 @@
+import sys
+import hashlib
+import struct
+
+sys.path.insert(0, "..")
+
+from utts import Synth
+
+# Checks that the NumPy IMA ADPCM decoder of the CPython host backend
+# (utts/host.py) is bit-exact with adpcm.decode used on MicroPython.
+# Run from this folder:
+#
+#   micropython adpcm_check.py   write golden/adpcm.txt from adpcm.decode
+#   python adpcm_check.py        compare utts.host.ima_decode with it
+
+FIXTURE = "golden/adpcm.txt"
+DATABASE = "../db/diphones_lq.db"
+KEYS = ("dh-ih", "s-ih", "ax-t", "p-iy", "pau-s", "ow-pau")
+HEAD = 32  # leading samples kept in the fixture for diagnostics
+
+
+def digest(data):
+    return "".join("%02x" % b for b in hashlib.sha256(data).digest())
+
+
+def decode_all():
+    """
+    :return: dict mapping key to decoded samples
+    """
+    synth = Synth(DATABASE, True)
+    decoded = {}
+    for key in KEYS:
+        decoded[key] = [int(sample) for sample in synth.get_diphone(key)]
+    synth.close()
+    return decoded
+
+
+def write_fixture(decoded):
+    with open(FIXTURE, "w") as f:
+        for key in KEYS:
+            samples = decoded[key]
+            data = struct.pack(f"<{len(samples)}h", *samples)
+            head = ",".join(str(sample) for sample in samples[:HEAD])
+            f.write(f"{key} {len(samples)} {digest(data)} {head}\n")
+    print(f"Written {FIXTURE}")
+
+
+def load_fixture():
+    fixture = {}
+    with open(FIXTURE, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 4:
+                fixture[fields[0]] = (int(fields[1]), fields[2], [int(s) for s in fields[3].split(",")])
+    return fixture
+
+
+def check(decoded):
+    """
+    :return: number of failed keys
+    """
+    try:
+        fixture = load_fixture()
+    except OSError:
+        print(f"No {FIXTURE}, generate it with: micropython adpcm_check.py")
+        return len(KEYS)
+
+    failures = 0
+    for key in KEYS:
+        samples = decoded[key]
+        if key not in fixture:
+            print(f"MISS  {key}: not in fixture")
+            failures += 1
+            continue
+        count, golden_hash, head = fixture[key]
+        data = struct.pack(f"<{len(samples)}h", *samples)
+        if len(samples) != count or digest(data) != golden_hash:
+            print(f"DIFF  {key}: {len(samples)} samples, fixture {count}")
+            print(f"      host    {samples[:HEAD]}")
+            print(f"      fixture {head}")
+            failures += 1
+        else:
+            print(f"OK    {key}: {count} samples")
+    return failures
+
+
+def measure():
+    """
+    Print decoding speed of the host decoder.
+    """
+    import time
+    from utts.host import ima_decode
+    from utts import bdb
+
+    with open(DATABASE, "rb") as f:
+        db = bdb.open(f)
+        values = [db[key] for key in db.keys()]
+    start = time.perf_counter()
+    samples = sum(len(ima_decode(value)) for value in values)
+    elapsed = time.perf_counter() - start
+    print(f"ima_decode: {samples} samples of {len(values)} diphones in {elapsed*1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    decoded = decode_all()
+    if sys.implementation.name == "micropython":
+        write_fixture(decoded)
+    else:
+        failures = check(decoded)
+        measure()
+        print(f"{failures} failed of {len(KEYS)}")
+        if failures:
+            sys.exit(1)
@@ -0,0 +1,67 @@
+import sys
+
+sys.path.insert(0, "..")
+
+from utts import Utterance, Synth
+from utts.pipeline import Pipeline, split_clauses
+from utts.synth import ticks_ms, ticks_diff
+
+# Compares clause-by-clause synthesis with and without Pipeline using
+# the real front-end and synthesizer. Both stages are Python code, so
+# they only overlap where one of them waits for I/O (database reads)
+# and the interpreter lets the other thread run.
+#
+# Usage: pipeline.py lexicon.db diphones.db [compressed]
+
+CROSSFADE = 0.025
+TEXT = ("This is a test. The quick brown fox jumps over the lazy dog, twice. "
+        "Meeting on 12.05.2024 at noon. There are 1234 apples and 17 pears! "
+        "Call me tomorrow, if you can. Speech synthesis runs offline.")
+
+
+def sequential(utterance, synth, text):
+    """
+    :return: milliseconds to first audio and in total
+    """
+    start = ticks_ms()
+    first = None
+    for clause in split_clauses(text):
+        utterance.process(clause)
+        synth.synthesize(utterance.get_diphones(), CROSSFADE)
+        synth.get_audio()
+        if first is None:
+            first = ticks_diff(ticks_ms(), start)
+    return first, ticks_diff(ticks_ms(), start)
+
+
+def pipelined(utterance, synth, text):
+    """
+    :return: milliseconds to first audio and in total
+    """
+    start = ticks_ms()
+    first = None
+    with Pipeline(utterance, synth, CROSSFADE) as pipeline:
+        for audio in pipeline.speak(text):
+            if first is None:
+                first = ticks_diff(ticks_ms(), start)
+    return first, ticks_diff(ticks_ms(), start)
+
+
+def main(lexicon_db, diphones_db, compressed=False):
+    utterance = Utterance(lexicon_db)
+    synth = Synth(diphones_db, compressed)
+    print(f"{len(split_clauses(TEXT))} clauses")
+
+    # Warm up, so opening the databases is not measured
+    sequential(utterance, synth, TEXT)
+
+    for name, run in (("sequential", sequential), ("pipelined", pipelined)):
+        first, total = run(utterance, synth, TEXT)
+        print(f"{name}: first audio after {first} ms, {total} ms in total")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: pipeline.py lexicon.db diphones.db [compressed]")
+    else:
+        main(sys.argv[1], sys.argv[2], len(sys.argv) > 3 and sys.argv[3] == "compressed")
@@ -0,0 +1,257 @@
+import sys
+import gc
+import os
+import array
+import hashlib
+
+sys.path.insert(0, "..")
+
+from utts import Utterance, Synth
+from utts import store
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Golden-output and allocation regression check of the synthesis hot paths.
+# Renders a fixed corpus through every available diphone database, hashes
+# the output of Synth.get_audio() and compares hashes and allocations with
+# golden/<implementation>.txt. Run from this folder, under micropython or python:
+#
+#   regress.py          check against golden files
+#   regress.py update   rewrite golden files from the current code
+#
+# "base" cases render through the MicroPython code paths of utts.synth,
+# on CPython they run as plain Python. "host" cases render through
+# utts.host on CPython and must produce the same audio as "base" ones.
+# Both decode ADPCM with utts.host.ima_decode, so lq cases do not
+# check it against adpcm.decode; adpcm_check.py does, once its
+# fixture has been written on MicroPython.
+
+GOLDEN = "golden/" + sys.implementation.name + ".txt"
+ALLOC_TOLERANCE = 0.10  # allowed allocation growth
+
+# PCM flat store built from the source recordings, diphones.db is not in the repository
+WAV_DB = "wav.db"
+WAV_DIR = "../db/diphones"
+
+DATABASES = (
+    ("pcm", "../db/diphones.db", False),
+    ("wav", WAV_DB, False),
+    ("lq", "../db/diphones_lq.db", True),
+    ("ulaw", "../db/diphones_ulaw.db", False),
+)
+
+if sys.implementation.name == "micropython":
+    SYNTHS = (("base", Synth),)
+else:
+    from utts.synth import Synth as BaseSynth
+    from utts.host import ima_decode
+
+    class ReferenceSynth(BaseSynth):
+        """
+        Synthesizer with the MicroPython code paths run as plain Python.
+        adpcm.decode only exists on MicroPython, ADPCM is decoded by
+        the host decoder, which adpcm_check.py compares with it.
+        """
+
+        def load_adpcm(self):
+            pass
+
+
+        @staticmethod
+        def unpack_adpcm(raw_audio):
+            return array.array("h", ima_decode(raw_audio).tolist())
+
+    SYNTHS = (("base", ReferenceSynth), ("host", Synth))
+
+CROSSFADES = (0, 0.025)
+
+# Diphone lists as produced by Utterance.get_diphones(), "w-er" is missing
+# from the databases and exercises emergency diphone search
+DIPHONES = (
+    ("test", ["dh-ih", "ih-s", "s-ih", "ih-z", "z-ax", "ax-t", "t-eh", "eh-s", "s-t", "t-pau4"]),
+    ("hello", ["hh-ax", "ax-l", "l-ow", "ow-pau2", "pau2-w", "w-er", "er-l", "l-d", "d-pau4"]),
+    ("speech", ["pau-s", "s-p", "p-iy", "iy-ch", "ch-s", "s-ih", "ih-n", "n-th", "th-ax", "ax-s", "s-ih",
+                "ih-s", "s-aa", "aa-n", "n-ax", "ax-m", "m-ay", "ay-k", "k-r", "r-ow", "ow-k", "k-ax",
+                "ax-n", "n-t", "t-r", "r-ow", "ow-l", "l-er", "er-pau4"]),
+)
+
+# Texts for the Utterance normalizer, which needs no lexicon
+TEXTS = (
+    ("plain", "This is a test, isn't it?"),
+    ("date", "Meeting on 12.05.2024 at noon."),
+    ("number", "There are 1234 apples and 17 pears!"),
+    ("phone", "Call +1 555-123-4567 now."),
+)
+
+
+def measure(function):
+    """
+    Run function and return its result and allocated bytes:
+    peak traced memory on CPython, heap growth with GC disabled on MicroPython.
+    """
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        result = function()
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        gc.disable()
+        before = gc.mem_alloc()
+        result = function()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+    return result, allocated
+
+
+def digest(data):
+    return "".join("%02x" % b for b in hashlib.sha256(data).digest())
+
+
+def normalize(utterance, text):
+    utterance.phrase = text
+    utterance.clean()
+    utterance.preprocess_dates_numbers()
+    utterance.punctuation()
+    utterance.delpunct()
+    return bytes(" ".join(utterance.phrase), "utf-8")
+
+
+def wav_data(data):
+    """
+    Return sample data of a RIFF WAVE file.
+    """
+    pos = 12
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos+4:pos+8], "little")
+        if data[pos:pos+4] == b"data":
+            return data[pos+8:pos+8+size]
+        pos += 8 + size + (size & 1)
+    raise ValueError("no data chunk")
+
+
+def build_wav_store():
+    """
+    Write a PCM flat store of the source recordings.
+    :return: False if the recordings are not available
+    """
+    try:
+        files = os.listdir(WAV_DIR)
+    except OSError:
+        return False
+    entries = {}
+    for filename in files:
+        if filename.endswith(".wav"):
+            with open(WAV_DIR + "/" + filename, "rb") as f:
+                entries[bytes(filename[:-4], "ascii")] = wav_data(f.read())
+    store.write_store(WAV_DB, entries, store.FORMAT_PCM)
+    return True
+
+
+def run():
+    """
+    :return: dict mapping case name to (hash, size, allocated bytes)
+    """
+    results = {}
+
+    utterance = Utterance("unused.db")
+    for name, text in TEXTS:
+        normalize(utterance, text)
+        data, allocated = measure(lambda: normalize(utterance, text))
+        results["normalizer/" + name] = (digest(data), len(data), allocated)
+
+    built = build_wav_store()
+    for db_name, filename, compressed in DATABASES:
+        try:
+            open(filename, "rb").close()
+        except OSError:
+            print(f"Skipping {filename}, not found")
+            continue
+        for synth_name, synth_class in SYNTHS:
+            synth = synth_class(filename, compressed)
+            for crossfade in CROSSFADES:
+                for name, diphones in DIPHONES:
+                    # Warm up, so opening the database is not measured
+                    synth.synthesize(diphones, crossfade)
+                    audio, allocated = measure(lambda: synth.synthesize(diphones, crossfade) or synth.get_audio())
+                    results[f"{synth_name}/{db_name}/{crossfade}/{name}"] = (digest(audio), len(audio)//2, allocated)
+            synth.close()
+    if built:
+        os.remove(WAV_DB)
+
+    return results
+
+
+def load_golden():
+    """
+    :return: golden results by case or None if there is no golden file
+    """
+    golden = {}
+    try:
+        with open(GOLDEN, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 4:
+                    golden[fields[0]] = (fields[1], int(fields[2]), int(fields[3]))
+    except OSError:
+        return None
+    return golden
+
+
+def save_golden(results):
+    with open(GOLDEN, "w") as f:
+        for case in sorted(results):
+            data_hash, size, allocated = results[case]
+            f.write(f"{case} {data_hash} {size} {allocated}\n")
+    print(f"Written {GOLDEN}")
+
+
+def check(results, golden):
+    """
+    :return: number of failed cases
+    """
+    failures = 0
+    for case in sorted(results):
+        data_hash, size, allocated = results[case]
+        if case.startswith("host/"):
+            base = results.get("base/" + case[5:])
+            if base is not None and base[0] != data_hash:
+                print(f"SPLIT {case}: output differs from base code paths ({size} samples, base {base[1]})")
+                failures += 1
+        if case not in golden:
+            print(f"NEW   {case}: {size} samples, not in {GOLDEN}, run with update if intended")
+            failures += 1
+            continue
+        golden_hash, golden_size, golden_allocated = golden[case]
+        if data_hash != golden_hash:
+            print(f"DRIFT {case}: output changed ({size} samples, golden {golden_size})")
+            failures += 1
+        elif allocated > golden_allocated*(1 + ALLOC_TOLERANCE):
+            print(f"ALLOC {case}: {allocated} bytes allocated, golden {golden_allocated}")
+            failures += 1
+        else:
+            print(f"OK    {case}: {allocated} bytes allocated, golden {golden_allocated}")
+    for case in sorted(golden):
+        if case not in results:
+            print(f"MISS  {case}: not rendered, database missing or failed to open")
+            failures += 1
+    return failures
+
+
+if __name__ == "__main__":
+    results = run()
+    if len(sys.argv) > 1 and sys.argv[1] == "update":
+        save_golden(results)
+    else:
+        golden = load_golden()
+        if golden is None:
+            # Rendering still ran, so crashes are caught, but nothing is compared
+            print(f"SKIP  no {GOLDEN} for {sys.implementation.name}, nothing compared; run with update to create it")
+            sys.exit(0)
+        failures = check(results, golden)
+        print(f"{failures} failed of {len(set(results) | set(golden))}")
+        if failures:
+            sys.exit(1)
@@ -2,9 +2,94 @@ import btree
 import wave
 import json
 import os
+import sys
 import struct
 import adpcm
 
+sys.path.insert(0, "..")
+from utts import store
+
+
+TRIM_FRAME = 80  # 5ms energy frames
+TRIM_GUARD = 400  # 25ms of near-silence kept for crossfading
+TRIM_THRESHOLD = 0.02  # frame energy relative to the loudest frame
+TRIM_FLOOR = 32  # absolute mean amplitude below which a frame is silent
+
+
+def trim_silence(key, samples):
+    """
+    Find energy-based boundaries of a diphone recording.
+    Silence next to a pause is part of the pause and is kept.
+    :return: start and end of the trimmed audio, head and tail join offsets
+    """
+    energies = []
+    for i in range(0, len(samples), TRIM_FRAME):
+        frame = samples[i:i+TRIM_FRAME]
+        energies.append(sum(abs(sample) for sample in frame) / len(frame))
+    if not energies:
+        return 0, len(samples), 0, 0
+    threshold = max(max(energies)*TRIM_THRESHOLD, TRIM_FLOOR)
+    loud = [i for i, energy in enumerate(energies) if energy >= threshold]
+    if not loud:
+        # Nothing but silence, keep it as it is
+        return 0, len(samples), 0, 0
+
+    onset = loud[0]*TRIM_FRAME
+    offset = min((loud[-1] + 1)*TRIM_FRAME, len(samples))
+    left, right = key.split("-")
+    if left == "pau":
+        onset = 0
+    if right == "pau":
+        offset = len(samples)
+
+    start = max(onset - TRIM_GUARD, 0)
+    end = min(offset + TRIM_GUARD, len(samples))
+    return start, end, onset - start, end - offset
+
+
+def ulaw_encode(sample):
+    """
+    Encode 16-bit PCM sample with G.711 u-law.
+    """
+    sign = 0
+    if sample < 0:
+        sign = 0x80
+        sample = -sample
+    if sample > 32635:
+        sample = 32635
+    sample += 0x84
+    exponent = 7
+    mask = 0x4000
+    while exponent > 0 and not sample & mask:
+        exponent -= 1
+        mask >>= 1
+    mantissa = (sample >> (exponent + 3)) & 0x0f
+    return ~(sign | (exponent << 4) | mantissa) & 0xff
+
+
+# Leading and trailing silence of the recordings is trimmed
+# and join offsets are stored in the index (or the flat store)
+trim = True
+block_size = 1024
+
+
+def read_diphone(filename):
+    """
+    Read samples of a diphone recording, trimmed if enabled.
+    :return: key, samples, (head, tail) join offsets and number of trimmed samples
+    """
+    key = filename[:-4]
+    with wave.open("diphones/"+filename, 'rb') as input_file:
+        samples = []
+        audio_data = input_file.readframes(block_size)
+        while audio_data:
+            samples.extend(struct.unpack(f"<{len(audio_data)//2}h", audio_data))
+            audio_data = input_file.readframes(block_size)
+    if not trim:
+        return key, samples, (0, 0), 0
+    start, end, head, tail = trim_silence(key, samples)
+    return key, samples[start:end], (head, tail), len(samples) - (end - start)
+
 
 f = open("lexicon.db", "w+b")
 db = btree.open(f)
@@ -29,30 +114,51 @@ f.close()
 
 
 compress = False
-f = open("diphones.db", "w+b")
+db_name = "diphones.db"
 #compress = True
-#f = open("diphones_lq.db", "w+b")
+#db_name = "diphones_lq.db"
+f = open(db_name, "w+b")
 db = btree.open(f)
-block_size = 1024
+counts = {}
+joins = {}
+trimmed = 0
 files = os.listdir("diphones")
 for n, filename in enumerate(files):
     print(f"File {n}/{len(files)}: {filename}")
-    with wave.open("diphones/"+filename, 'rb') as input_file:
-        out_data = bytearray()
-        in_data = []
-        audio_data = input_file.readframes(block_size)
-        while audio_data:
-            if compress:
-                in_data += struct.unpack(f"<{len(audio_data)//2}h", audio_data)
-            else:
-                out_data.extend(audio_data)
-            audio_data = input_file.readframes(block_size)
-        data_encoded = adpcm.encoder(in_data)
-        if compress:
-            for i in range(0, len(data_encoded)-2, 2):
-                samp1, samp2 = data_encoded[i:i+2]
-                two_samples = samp1 | (samp2 << 4)
-                out_data.append(two_samples)
-        db[bytes(filename[:-4], 'utf-8')] = out_data
+    key, samples, join, removed = read_diphone(filename)
+    trimmed += removed
+    out_data = bytearray()
+    if compress:
+        data_encoded = adpcm.encoder(samples)
+        for i in range(0, len(data_encoded)-2, 2):
+            samp1, samp2 = data_encoded[i:i+2]
+            two_samples = samp1 | (samp2 << 4)
+            out_data.append(two_samples)
+    else:
+        out_data.extend(struct.pack(f"<{len(samples)}h", *samples))
+    db[bytes(key, 'utf-8')] = out_data
+    counts[bytes(key, 'utf-8')] = store.sample_count(store.FORMAT_ADPCM if compress else store.FORMAT_PCM, len(out_data))
+    joins[bytes(key, 'utf-8')] = join
 db.close()
 f.close()
+print(f"Trimmed {trimmed} samples of silence")
+# Sample counts and join offsets for Synth, kept next to the database
+store.write_index(db_name + store.INDEX_SUFFIX, counts, joins)
+
+
+# G.711 u-law flat store, 8 bits per sample with table-driven decoding
+entries = {}
+joins = {}
+trimmed = 0
+files = os.listdir("diphones")
+for n, filename in enumerate(files):
+    print(f"File {n}/{len(files)}: {filename}")
+    key, samples, join, removed = read_diphone(filename)
+    trimmed += removed
+    out_data = bytearray()
+    for sample in samples:
+        out_data.append(ulaw_encode(sample))
+    entries[bytes(key, 'utf-8')] = out_data
+    joins[bytes(key, 'utf-8')] = join
+print(f"Trimmed {trimmed} samples of silence")
+store.write_store("diphones_ulaw.db", entries, store.FORMAT_ULAW, joins=joins)
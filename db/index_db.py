@@ -0,0 +1,31 @@
+import sys
+
+sys.path.insert(0, "..")
+
+from utts import Synth
+from utts import store
+
+# Writes the sidecar index (see utts/store.py) of a btree diphone
+# database, so Synth.get_duration() needs no audio reads. create_db.py
+# writes it along with the database, this is for databases built
+# without one. Every diphone is decoded once to count its samples.
+#
+# Usage: index_db.py diphones.db [compressed]
+
+
+def main(diphones_db, compressed=False):
+    synth = Synth(diphones_db, compressed)
+    synth.open_db()
+    samples = {}
+    for key, raw_audio in synth.db.items():
+        samples[bytes(key)] = len(synth.decode(raw_audio))
+    synth.close()
+    store.write_index(diphones_db + store.INDEX_SUFFIX, samples)
+    print(f"Written {diphones_db + store.INDEX_SUFFIX} with {len(samples)} diphones")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: index_db.py diphones.db [compressed]")
+    else:
+        main(sys.argv[1], len(sys.argv) > 2 and sys.argv[2] == "compressed")
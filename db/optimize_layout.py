@@ -0,0 +1,170 @@
+import sys
+
+sys.path.insert(0, "..")
+
+from utts import Utterance, Synth
+from utts.synth import strip_silence
+from utts import store
+
+# Writes a flat diphone store (see utts/store.py) whose audio data is
+# laid out so diphones used together in a text corpus share pages.
+#
+# Usage: optimize_layout.py corpus.txt lexicon.db diphones.db output.db [compressed]
+# corpus.txt holds one sentence per line.
+
+PAGE_SIZE = 4096
+
+
+def collect(corpus, lexicon_db):
+    """
+    Run the corpus through Utterance and collect diphone sets per sentence.
+    """
+    utterance = Utterance(lexicon_db)
+    sentences = []
+    with open(corpus, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            utterance.process(line)
+            sentences.append(set(strip_silence(d) for d in utterance.get_diphones()))
+    return sentences
+
+
+def cooccurrence(sentences):
+    """
+    Count how often every diphone and every pair of diphones occur in one sentence.
+    """
+    counts = {}
+    pairs = {}
+    for units in sentences:
+        units = sorted(units)
+        for i, a in enumerate(units):
+            counts[a] = counts.get(a, 0) + 1
+            for b in units[i+1:]:
+                neighbours = pairs.setdefault(a, {})
+                neighbours[b] = neighbours.get(b, 0) + 1
+                neighbours = pairs.setdefault(b, {})
+                neighbours[a] = neighbours.get(a, 0) + 1
+    return counts, pairs
+
+
+def cluster(counts, pairs, sizes):
+    """
+    Greedily fill pages: start a page with the most frequent unplaced
+    diphone, then keep adding the one most often co-used with the page.
+    """
+    order = []
+    unplaced = set(k for k in counts if k in sizes)
+    by_frequency = sorted(unplaced, key=lambda k: -counts[k])
+    while unplaced:
+        # Start a new page
+        seed = None
+        for key in by_frequency:
+            if key in unplaced:
+                seed = key
+                break
+        page_used = 0
+        scores = {}
+        key = seed
+        while key is not None:
+            order.append(key)
+            unplaced.discard(key)
+            page_used += sizes[key]
+            if page_used >= PAGE_SIZE:
+                break
+            for other, n in pairs.get(key, {}).items():
+                if other in unplaced:
+                    scores[other] = scores.get(other, 0) + n
+            scores.pop(key, None)
+            key = None
+            best = 0
+            for other, score in scores.items():
+                if other in unplaced and (score > best or (score == best and key is not None and counts[other] > counts[key])):
+                    key = other
+                    best = score
+    return order
+
+
+def store_pages(offset, size):
+    """
+    Numbers of file pages holding audio at the given file offset.
+    """
+    return range(offset//PAGE_SIZE, (offset + size - 1)//PAGE_SIZE + 1)
+
+
+def page_reads(sentences, pages_of):
+    """
+    Average number of distinct pages read per sentence.
+    """
+    total = 0
+    for units in sentences:
+        pages = set()
+        for unit in units:
+            try:
+                pages.update(pages_of(unit))
+            except KeyError:
+                pass
+        total += len(pages)
+    return total / max(len(sentences), 1)
+
+
+def main(corpus, lexicon_db, diphones_db, output_db, compressed=False):
+    synth = Synth(diphones_db, compressed)
+    synth.open_db()
+    data_format = synth.db_format
+    entries = {}
+    for key, raw_audio in synth.db.items():
+        entries[bytes(key)] = bytes(raw_audio)
+    sizes = dict((str(k, "ascii"), len(v)) for k, v in entries.items())
+
+    print(f"Processing corpus {corpus}")
+    sentences = collect(corpus, lexicon_db)
+    counts, pairs = cooccurrence(sentences)
+    print(f"{len(sentences)} sentences, {len(counts)} distinct diphones")
+
+    if hasattr(synth.db, "pages_of"):
+        before = page_reads(sentences, lambda unit: synth.db.pages_of(bytes(unit, "ascii")))
+        print(f"Source btree: {before:.1f} page reads per sentence")
+    elif isinstance(synth.db, store.Store):
+        source = synth.db
+
+        def source_pages(unit):
+            index = source.find(bytes(unit, "ascii"))
+            if index < 0:
+                raise KeyError(unit)
+            return store_pages(source.data_start + source.offsets[index], source.sizes[index])
+
+        print(f"Source store: {page_reads(sentences, source_pages):.1f} page reads per sentence")
+    else:
+        # The btree module of MicroPython does not expose page numbers
+        print("Source btree: page reads are only reported when run with python (utts.bdb reader)")
+
+    # Audio data follows header and key table of the store
+    data_start = store.table_size(entries)
+
+    def layout_pages(order):
+        offsets = {}
+        offset = data_start
+        for key in order:
+            offsets[key] = offset
+            offset += sizes[key]
+        return lambda unit: store_pages(offsets[unit], sizes[unit])
+
+    key_order = sorted(sizes)
+    print(f"Key order: {page_reads(sentences, layout_pages(key_order)):.1f} page reads per sentence")
+
+    order = cluster(counts, pairs, sizes)
+    placed = set(order)
+    order.extend(k for k in key_order if k not in placed)
+    print(f"Clustered: {page_reads(sentences, layout_pages(order)):.1f} page reads per sentence")
+
+    store.write_store(output_db, entries, data_format, [bytes(k, "ascii") for k in order])
+    print(f"Written {output_db}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print("Usage: optimize_layout.py corpus.txt lexicon.db diphones.db output.db [compressed]")
+    else:
+        main(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], len(sys.argv) > 5 and sys.argv[5] == "compressed")
@@ -1,2 +1,13 @@
 from .utterance import Utterance
-from .synth import Synth
\ No newline at end of file
+
+try:
+    import micropython
+    from .synth import Synth
+except ImportError:
+    # CPython host backend, imported on first use so
+    # front-end-only tools do not need NumPy
+    def __getattr__(name):
+        if name == "Synth":
+            from .host import Synth
+            return Synth
+        raise AttributeError(f"module 'utts' has no attribute '{name}'")
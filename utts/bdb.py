@@ -0,0 +1,164 @@
+import struct
+
+# Read-only reader of btree files written by the MicroPython
+# btree module (Berkeley DB 1.x format), for use on CPython hosts.
+
+BTREEMAGIC = 0x053162
+
+P_BINTERNAL = 0x01
+P_BLEAF = 0x02
+P_OVERFLOW = 0x04
+P_TYPE = 0x1f
+
+P_BIGDATA = 0x01
+P_BIGKEY = 0x02
+
+# pgno, prevpg, nextpg, flags, lower, upper
+PAGE_HEADER = "<IIIIHH"
+BTDATAOFF = 20
+ROOT_PAGE = 1
+
+
+def open(stream, cachesize=0, pagesize=0, minkeypage=0):
+    """
+    Open a btree database from a binary stream.
+    Arguments other than stream are accepted for
+    compatibility with the MicroPython btree module.
+    """
+    return BTree(stream)
+
+
+class BTree:
+    def __init__(self, stream):
+        """
+        Read all leaf pages of the database into a sorted key list.
+        """
+        self.stream = stream
+        stream.seek(0)
+        magic, version, psize = struct.unpack("<III", stream.read(12))
+        self.byteorder = "<"
+        if magic != BTREEMAGIC:
+            magic, version, psize = struct.unpack(">III", struct.pack("<III", magic, version, psize))
+            self.byteorder = ">"
+            if magic != BTREEMAGIC:
+                raise ValueError("not a btree database")
+        self.psize = psize
+
+        self.index = {}
+        self.sorted_keys = []
+
+        # Descend to the leftmost leaf, then follow the leaf chain
+        pgno = ROOT_PAGE
+        page = self.read_page(pgno)
+        while page[3] & P_TYPE == P_BINTERNAL:
+            data = page[6]
+            ofs = struct.unpack_from(self.byteorder + "H", data, BTDATAOFF)[0]
+            pgno = struct.unpack_from(self.byteorder + "I", data, ofs + 4)[0]
+            page = self.read_page(pgno)
+
+        while True:
+            if page[3] & P_TYPE != P_BLEAF:
+                raise ValueError(f"unexpected page type {page[3]:#x} in leaf chain")
+            self.read_leaf(pgno, page)
+            pgno = page[2]
+            if pgno == 0:
+                break
+            page = self.read_page(pgno)
+
+
+    def read_page(self, pgno):
+        self.stream.seek(pgno*self.psize)
+        data = self.stream.read(self.psize)
+        return struct.unpack_from(self.byteorder + PAGE_HEADER[1:], data) + (data,)
+
+
+    def read_overflow(self, pgno, size):
+        chunks = []
+        while size > 0:
+            page = self.read_page(pgno)
+            chunk = page[6][BTDATAOFF:BTDATAOFF+size]
+            chunks.append(chunk)
+            size -= len(chunk)
+            pgno = page[2]
+        return b"".join(chunks)
+
+
+    def read_leaf(self, pgno, page):
+        data = page[6]
+        lower = page[4]
+        for i in range((lower - BTDATAOFF)//2):
+            ofs = struct.unpack_from(self.byteorder + "H", data, BTDATAOFF + i*2)[0]
+            ksize, dsize, flags = struct.unpack_from(self.byteorder + "IIB", data, ofs)
+            pos = ofs + 9
+            if flags & P_BIGKEY:
+                key = self.read_overflow(*struct.unpack_from(self.byteorder + "II", data, pos))
+                pos += 8
+            else:
+                key = data[pos:pos+ksize]
+                pos += ksize
+            if flags & P_BIGDATA:
+                # Read on access, overflow chains can be large
+                value = struct.unpack_from(self.byteorder + "II", data, pos)
+            else:
+                value = data[pos:pos+dsize]
+            self.index[key] = (pgno, flags & P_BIGDATA, value)
+            self.sorted_keys.append(key)
+
+
+    def pages_of(self, key):
+        """
+        Return numbers of all pages read to fetch the key's value:
+        its leaf page followed by overflow pages, if any.
+        """
+        pgno, big, value = self.index[key]
+        pages = [pgno]
+        if big:
+            pgno, size = value
+            while size > 0:
+                pages.append(pgno)
+                size -= self.psize - BTDATAOFF
+                pgno = self.read_page(pgno)[2]
+        return pages
+
+
+    def __getitem__(self, key):
+        pgno, big, value = self.index[key]
+        if big:
+            return self.read_overflow(*value)
+        return value
+
+
+    def __contains__(self, key):
+        return key in self.index
+
+
+    def __iter__(self):
+        return iter(self.sorted_keys)
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def keys(self):
+        return iter(self.sorted_keys)
+
+
+    def values(self):
+        return (self[k] for k in self.sorted_keys)
+
+
+    def items(self):
+        return ((k, self[k]) for k in self.sorted_keys)
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        self.index = {}
+        self.sorted_keys = []
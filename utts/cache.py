@@ -0,0 +1,168 @@
+try:
+    import _thread
+except ImportError:
+    # Port built without threads
+    _thread = None
+
+
+class CacheBudget:
+    def __init__(self, size):
+        """
+        RAM budget in bytes, shared by caches of one or more owners.
+        Owners may reserve from different threads (see utts.pipeline).
+        """
+        self.size = size
+        self.used = 0
+        self.usage = {}
+        self.lock = _thread.allocate_lock() if _thread is not None else None
+    
+    
+    def reserve(self, owner, nbytes):
+        """
+        Account nbytes to the owner if they fit into the budget.
+        :return: True if the bytes were reserved
+        """
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            if self.used + nbytes > self.size:
+                return False
+            self.used += nbytes
+            self.usage[owner] = self.usage.get(owner, 0) + nbytes
+            return True
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+    
+    
+    def release(self, owner, nbytes=None):
+        """
+        Return nbytes, or all bytes, of the owner to the budget.
+        """
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            held = self.usage.pop(owner, 0)
+            if nbytes is not None and nbytes < held:
+                self.usage[owner] = held - nbytes
+                held = nbytes
+            self.used -= held
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+    
+    
+    def report(self):
+        """
+        Return a copy of bytes used per owner.
+        """
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            return dict(self.usage)
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+
+
+class Cache:
+    def __init__(self, budget, owner):
+        """
+        Cache of one owner in a shared budget. When the budget is
+        full, least recently used entries of the owner make room.
+        """
+        self.budget = budget
+        self.owner = owner
+        self.entries = {}
+        self.sizes = {}
+        self.last_used = {}
+        self.clock = 0
+        self.oldest = 0
+    
+    
+    def __contains__(self, key):
+        return key in self.entries
+    
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    
+    def get(self, key, default=None):
+        """
+        Return cached value and mark it as recently used.
+        """
+        value = self.entries.get(key)
+        if value is None:
+            return default
+        self.clock += 1
+        self.last_used[key] = self.clock
+        return value
+    
+    
+    def fits(self, nbytes):
+        """
+        Return True if nbytes fit into the budget without evicting.
+        """
+        return self.budget.used + nbytes <= self.budget.size
+    
+    
+    def put(self, key, value, nbytes, oldest=False):
+        """
+        Add an entry, evicting least recently used ones if needed.
+        :param oldest: add it as the least recently used entry and
+                       do not evict others (used to restore a snapshot)
+        :return: True if the entry was added
+        """
+        if key in self.entries or nbytes > self.budget.size:
+            return False
+        while not self.budget.reserve(self.owner, nbytes):
+            if oldest or not self.evict():
+                return False
+        self.entries[key] = value
+        self.sizes[key] = nbytes
+        if oldest:
+            self.oldest -= 1
+            self.last_used[key] = self.oldest
+        else:
+            self.clock += 1
+            self.last_used[key] = self.clock
+        return True
+    
+    
+    def evict(self):
+        """
+        Drop the least recently used entry.
+        :return: False if the cache is empty
+        """
+        if not self.entries:
+            return False
+        key = None
+        for k, used in self.last_used.items():
+            if key is None or used < self.last_used[key]:
+                key = k
+        del self.entries[key]
+        del self.last_used[key]
+        self.budget.release(self.owner, self.sizes.pop(key))
+        return True
+    
+    
+    def items(self):
+        """
+        Return (key, value) pairs, most recently used first.
+        """
+        keys = sorted(self.entries, key=lambda k: -self.last_used[k])
+        return [(k, self.entries[k]) for k in keys]
+    
+    
+    def clear(self):
+        """
+        Drop all entries and return their memory to the budget.
+        """
+        nbytes = 0
+        for size in self.sizes.values():
+            nbytes += size
+        self.entries = {}
+        self.sizes = {}
+        self.last_used = {}
+        self.budget.release(self.owner, nbytes)
@@ -0,0 +1,33 @@
+import time
+
+# Stand-ins for MicroPython-only builtins, used when
+# the library is imported on a CPython host.
+
+
+def const(value):
+    return value
+
+
+def native(function):
+    return function
+
+
+def viper(function):
+    return function
+
+
+def ticks_ms():
+    return int(time.monotonic()*1000)
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def ptr8(buffer):
+    # viper pointers index like the buffer itself
+    return buffer
+
+
+def ptr16(buffer):
+    return buffer
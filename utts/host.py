@@ -0,0 +1,164 @@
+import array
+
+import numpy as np
+
+from .synth import Synth as BaseSynth
+
+# Synthesizer backend for CPython hosts (servers, desktops).
+# Databases are read with utts.bdb, hot paths use NumPy.
+# bench/regress.py compares its output with the MicroPython code
+# paths run on CPython. The ADPCM decoder is only checked against
+# adpcm.decode once bench/golden/adpcm.txt is written on MicroPython.
+
+IMA_INDEX_TABLE = np.array((-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8), dtype=np.int64)
+
+IMA_STEP_TABLE = np.array((
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767), dtype=np.int64)
+
+
+def ima_decode(raw_audio):
+    """
+    Decode IMA ADPCM bytes (two 4-bit codes per byte, low nibble first)
+    into 16-bit samples.
+    """
+    packed = np.frombuffer(raw_audio, dtype=np.uint8)
+    codes = np.empty(len(packed)*2, dtype=np.int64)
+    codes[0::2] = packed & 0x0f
+    codes[1::2] = packed >> 4
+
+    # Step index depends only on codes, but its clamping is sequential
+    index = np.empty(len(codes), dtype=np.int64)
+    i = 0
+    for n, delta in enumerate(IMA_INDEX_TABLE[codes].tolist()):
+        index[n] = i
+        i += delta
+        if i < 0:
+            i = 0
+        elif i > 88:
+            i = 88
+
+    step = IMA_STEP_TABLE[index]
+    diff = step >> 3
+    diff += np.where(codes & 4, step, 0)
+    diff += np.where(codes & 2, step >> 1, 0)
+    diff += np.where(codes & 1, step >> 2, 0)
+    diff = np.where(codes & 8, -diff, diff)
+
+    predictor = np.cumsum(diff)
+    if len(predictor) == 0 or (predictor.min() >= -32768 and predictor.max() <= 32767):
+        return predictor.astype(np.int16)
+
+    # The predictor was clamped somewhere, fall back to sequential decoding
+    out = np.empty(len(codes), dtype=np.int16)
+    p = 0
+    for n, d in enumerate(diff.tolist()):
+        p += d
+        if p < -32768:
+            p = -32768
+        elif p > 32767:
+            p = 32767
+        out[n] = p
+    return out
+
+
+class Synth(BaseSynth):
+    """
+    Synthesizer for CPython hosts. Has the same API as
+    the MicroPython synthesizer.
+    """
+
+    def load_adpcm(self):
+        # ADPCM is decoded by ima_decode()
+        pass
+
+
+    def ram_samples(self, raw_audio):
+        return array.array("h", self.decode(raw_audio).tobytes())
+
+
+    def cache_put(self, diphone, audio, oldest=False):
+        if diphone in self.cache:
+            return
+        self.cache.put(diphone, np.asarray(audio, dtype=np.int16), len(audio)*2, oldest)
+
+
+    @staticmethod
+    def unpack_pcm(raw_audio):
+        return np.frombuffer(raw_audio, dtype="<i2").astype(np.int16)
+
+
+    def unpack_ulaw(self, raw_audio):
+        table = np.asarray(self.ulaw_table, dtype=np.int16)
+        return table[np.frombuffer(raw_audio, dtype=np.uint8)]
+
+
+    @staticmethod
+    def unpack_adpcm(raw_audio):
+        return ima_decode(raw_audio)
+
+
+    def add_silence(self):
+        length = int(self.silence_length*self.SAMPLE_RATE)
+        self.output_audios.append(np.zeros(length, dtype=np.int16))
+
+
+    def concatenate(self, audios, crossfade=0, joins=None):
+        """
+        Join audio chunks into one waveform, with the same
+        cut points and fixed-point crossfade as Synth.concatenate().
+        """
+        window_len = int(crossfade*self.SAMPLE_RATE) if crossfade > 0 else 0
+        audios = [np.asarray(audio, dtype=np.int16) for audio in audios]
+
+        # Drop the near-silent ends marked by join offsets,
+        # the head of the first and the tail of the last chunk are kept
+        if joins is not None:
+            last = len(audios) - 1
+            while last > 0 and len(audios[last]) == 0:
+                last -= 1
+            started = False
+            for i in range(len(audios)):
+                count = len(audios[i])
+                if count == 0:
+                    continue
+                head, tail = joins[i]
+                start = min(head, count) if started else 0
+                end = count - tail if i < last else count
+                audios[i] = audios[i][start:max(end, start)]
+                started = started or len(audios[i]) > 0
+
+        # Output length is known in advance, so it is allocated once
+        total = 0
+        for audio in audios:
+            total += len(audio) - min(window_len, total, len(audio))
+        output_audio = np.empty(total, dtype=np.int16)
+
+        pos = 0
+        for audio in audios:
+            len2 = len(audio)
+            if len2 == 0:
+                continue
+            steps = min(window_len, pos, len2)
+            if steps > 0:
+                fade_ratio = np.arange(steps, dtype=np.int64) * ((1 << 16) // steps)
+                tail = output_audio[pos-steps:pos].astype(np.int64)
+                head = audio[:steps].astype(np.int64)
+                output_audio[pos-steps:pos] = (tail*((1 << 16) - fade_ratio) + head*fade_ratio) >> 16
+            output_audio[pos:pos+len2-steps] = audio[steps:]
+            pos += len2 - steps
+
+        return output_audio
+
+
+    def get_audio(self, chunk_size=2048):
+        """
+        Return synthesized output audio data as little-endian 16-bit PCM.
+        """
+        if self.output_audio is None:
+            return bytearray()
+        return bytearray(self.output_audio.astype("<i2").tobytes())
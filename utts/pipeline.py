@@ -0,0 +1,158 @@
+import _thread
+
+# Runs Utterance on the next clause in a background thread while
+# Synth renders the current one. _thread is available both on
+# MicroPython and on CPython.
+
+CLAUSE_PUNCTUATION = ".,;:?!"
+
+# Utterance.unknownword() recurses, default thread stacks
+# of small ports (e.g. ESP32) are too small for it
+FRONTEND_STACK_SIZE = 32*1024
+
+
+def split_clauses(text):
+    """
+    Split text after punctuation that is followed by whitespace,
+    so numbers and dates like 3.5 or 01.02.2024 stay intact.
+    """
+    clauses = []
+    start = 0
+    for i in range(len(text)):
+        if text[i] in CLAUSE_PUNCTUATION and (i + 1 == len(text) or text[i+1] in " \t\r\n"):
+            clauses.append(text[start:i+1])
+            start = i + 1
+    clauses.append(text[start:])
+    return [clause.strip() for clause in clauses if clause.strip()]
+
+
+class BoundedQueue:
+    def __init__(self, size):
+        self.items = []
+        self.size = size
+        self.lock = _thread.allocate_lock()
+        # Held by a waiting reader/writer, released when the queue changes
+        self.readable = _thread.allocate_lock()
+        self.writable = _thread.allocate_lock()
+
+
+    def put(self, item):
+        while True:
+            self.lock.acquire()
+            if len(self.items) < self.size:
+                self.items.append(item)
+                if self.readable.locked():
+                    self.readable.release()
+                self.lock.release()
+                return
+            self.lock.release()
+            self.writable.acquire()
+
+
+    def get(self):
+        while True:
+            self.lock.acquire()
+            if self.items:
+                item = self.items.pop(0)
+                if self.writable.locked():
+                    self.writable.release()
+                self.lock.release()
+                return item
+            self.lock.release()
+            self.readable.acquire()
+
+
+class Pipeline:
+    def __init__(self, utterance, synth, crossfade=0, queue_size=2, stack_size=FRONTEND_STACK_SIZE):
+        """
+        Initialize pipeline.
+        :param queue_size: number of clauses the front-end may process ahead
+        :param stack_size: stack size in bytes of the front-end thread
+        """
+        self.utterance = utterance
+        self.synth = synth
+        self.crossfade = crossfade
+        self.queue_size = queue_size
+        self.stack_size = stack_size
+        self.stopped = False
+        self.generator = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+    def close(self):
+        """
+        Stop the running speak() generator, if any, and wait for its
+        front-end thread to exit.
+        """
+        if self.generator is not None:
+            self.generator.close()
+            self.generator = None
+
+
+    def frontend(self, queue, clauses, spell):
+        """
+        Front-end worker, turns clauses into diphone lists.
+        """
+        try:
+            for clause in clauses:
+                if self.stopped:
+                    break
+                self.utterance.process(clause, spell)
+                queue.put(self.utterance.get_diphones())
+        except Exception as e:
+            # Handed over to the synthesis side and raised there
+            queue.put(e)
+        queue.put(None)
+
+
+    def speak(self, text, spell=False):
+        """
+        Synthesize text clause by clause.
+        MicroPython does not finalize abandoned generators, so the
+        returned one must be exhausted or closed, either directly or
+        by using the pipeline in a with block, otherwise the front-end
+        thread keeps waiting on the queue.
+        :return: generator of audio data of every clause as soon as it is ready
+        """
+        self.close()
+        self.generator = self.render(text, spell)
+        return self.generator
+
+
+    def render(self, text, spell):
+        """
+        Generator behind speak().
+        """
+        queue = BoundedQueue(self.queue_size)
+        self.stopped = False
+        default_stack_size = _thread.stack_size(self.stack_size)
+        try:
+            _thread.start_new_thread(self.frontend, (queue, split_clauses(text), spell))
+        finally:
+            _thread.stack_size(default_stack_size)
+
+        finished = False
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                self.synth.synthesize(item, self.crossfade)
+                yield self.synth.get_audio()
+        finally:
+            if not finished:
+                # Stop the front-end and wait for it to exit
+                self.stopped = True
+                while queue.get() is not None:
+                    pass
@@ -0,0 +1,91 @@
+from . import Synth
+from .utterance import Utterance, Lexicon
+from .cache import CacheBudget
+from .synth import ticks_ms, ticks_diff
+
+
+class Registry:
+    def __init__(self, lexicon_db, cache_size=0, idle_ms=60000):
+        """
+        Hands out utterances sharing one lexicon handle and
+        synthesizers of registered voices, opened on first use.
+        All caches share one RAM budget.
+        :param cache_size: RAM budget in bytes for lexicon and diphone caches
+        :param idle_ms: voices unused for that long are closed by close_idle()
+        """
+        self.budget = CacheBudget(cache_size)
+        self.lexicon = Lexicon(lexicon_db, budget=self.budget)
+        self.idle_ms = idle_ms
+        self.voices = {}
+        self.synths = {}
+        self.last_used = {}
+
+
+    def add_voice(self, name, diphones_db, compressed=False, in_ram=False, keep_compressed=True):
+        """
+        Register a voice. Arguments are those of Synth.
+        In-RAM voices are refused with MemoryError when
+        opened if their inventory does not fit into the budget.
+        """
+        self.voices[name] = (diphones_db, compressed, in_ram, keep_compressed)
+
+
+    def utterance(self):
+        """
+        Return new utterance using the shared lexicon.
+        """
+        return Utterance(self.lexicon)
+
+
+    def synth(self, name):
+        """
+        Return synthesizer of the voice, opening it if needed.
+        Call it for every use, so the voice is not considered idle.
+        """
+        synth = self.synths.get(name)
+        if synth is None:
+            diphones_db, compressed, in_ram, keep_compressed = self.voices[name]
+            synth = Synth(diphones_db, compressed, in_ram, keep_compressed, budget=self.budget, owner=name)
+            self.synths[name] = synth
+        self.last_used[name] = ticks_ms()
+        return synth
+
+
+    def close_voice(self, name):
+        """
+        Close database of the voice and free its cache
+        and in_ram inventory.
+        """
+        synth = self.synths.pop(name, None)
+        if synth is not None:
+            synth.close()
+            synth.drop_cache()
+            self.budget.release(name)
+        self.last_used.pop(name, None)
+
+
+    def close_idle(self):
+        """
+        Close voices that were not used for idle_ms.
+        :return: names of closed voices
+        """
+        now = ticks_ms()
+        idle = [name for name, used in self.last_used.items() if ticks_diff(now, used) >= self.idle_ms]
+        for name in idle:
+            self.close_voice(name)
+        return idle
+
+
+    def usage(self):
+        """
+        Return bytes used per lexicon database and voice name,
+        caches and in_ram inventories alike.
+        """
+        return self.budget.report()
+
+
+    def close(self):
+        for name in list(self.synths):
+            self.close_voice(name)
+        self.lexicon.close()
+        self.lexicon.drop_cache()
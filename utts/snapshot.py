@@ -0,0 +1,97 @@
+import os
+import array
+import struct
+
+MAGIC = b"UTSS"
+
+LEXICON_ENTRY = 0x4c  # 'L'
+DIPHONE_ENTRY = 0x44  # 'D'
+
+
+def save_snapshot(filename, utterance=None, synth=None):
+    """
+    Save lexicon entries and decoded diphones cached by
+    the utterance and synthesizer, so they can be reloaded
+    after a reboot or deep sleep wake. Entries are saved
+    most recently used first.
+    Record layout: type (1 byte), key length (1 byte),
+    value length (4 bytes), key, value.
+    The file is written under a temporary name and renamed,
+    so a save cut off by power loss keeps the previous snapshot.
+    """
+    temp = filename + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(MAGIC)
+        if utterance is not None:
+            for word, entry in utterance.cache.items():
+                key = bytes(word, "ascii")
+                f.write(struct.pack("<BBI", LEXICON_ENTRY, len(key), len(entry)))
+                f.write(key)
+                f.write(entry)
+        if synth is not None:
+            for diphone, audio in synth.cache.items():
+                key = bytes(diphone, "ascii")
+                f.write(struct.pack("<BBI", DIPHONE_ENTRY, len(key), len(audio)*2))
+                f.write(key)
+                f.write(bytes(audio))
+    os.rename(temp, filename)
+
+
+def load_snapshot(filename, utterance=None, synth=None):
+    """
+    Fill utterance and synthesizer caches from a snapshot file,
+    reading it record by record. Entries that do not fit into
+    the cache budgets are skipped, a truncated or invalid
+    record ends loading.
+    :return: number of loaded entries
+    """
+    try:
+        f = open(filename, "rb")
+    except OSError:
+        print(f"No snapshot {filename}")
+        return 0
+    
+    loaded = 0
+    with f:
+        if f.read(4) != MAGIC:
+            print(f"Invalid snapshot {filename}")
+            return 0
+        
+        while True:
+            header = f.read(6)
+            if not header:
+                break
+            if len(header) < 6:
+                print(f"Truncated snapshot {filename}")
+                break
+            entry_type, key_len, value_len = struct.unpack("<BBI", header)
+            if entry_type == LEXICON_ENTRY:
+                cache = utterance.cache if utterance is not None else None
+                nbytes = key_len + value_len
+            elif entry_type == DIPHONE_ENTRY and not value_len & 1:
+                cache = synth.cache if synth is not None else None
+                nbytes = value_len
+            else:
+                print(f"Invalid record in snapshot {filename}")
+                break
+            
+            key = f.read(key_len)
+            if len(key) < key_len:
+                print(f"Truncated snapshot {filename}")
+                break
+            key = str(key, "ascii")
+            if cache is None or key in cache or not cache.fits(nbytes):
+                f.seek(value_len, 1)
+                continue
+            value = f.read(value_len)
+            if len(value) < value_len:
+                print(f"Truncated snapshot {filename}")
+                break
+            
+            if entry_type == LEXICON_ENTRY:
+                utterance.cache_put(key, value, True)
+            else:
+                synth.cache_put(key, array.array("h", value), True)
+            loaded += 1
+    
+    return loaded
@@ -0,0 +1,271 @@
+import struct
+import array
+
+# Flat diphone store: a small header and a key table, which are
+# kept in RAM, followed by audio data. The key table is sorted for
+# binary search, while the audio data may be laid out in any order
+# (see db/optimize_layout.py).
+#
+# Header:  magic (4 bytes), version (1 byte), format (1 byte),
+#          entry count (2 bytes), data start (4 bytes)
+# Entry:   key length (1 byte), key, data offset (4 bytes), data size (4 bytes),
+#          sample count (4 bytes, since version 2),
+#          head and tail join offsets (2 bytes each, since version 3)
+#
+# Join offsets are the numbers of near-silent samples kept at the
+# start and end of a trimmed diphone, which Synth overlaps when splicing.
+#
+# btree databases keep sample counts and join offsets in a sidecar
+# index file, named like the database with INDEX_SUFFIX appended.
+#
+# Header:  magic (4 bytes), version (1 byte), flags (1 byte), entry count (2 bytes)
+# Entry:   key length (1 byte), key, sample count (4 bytes),
+#          head and tail join offsets (2 bytes each)
+
+MAGIC = b"UTDS"
+VERSION = 3
+
+INDEX_MAGIC = b"UTDI"
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+INDEX_HEADER = "<4sBBH"
+INDEX_HEADER_SIZE = 8
+INDEX_JOINS = 0x01  # flag: some join offsets are not zero
+
+FORMAT_PCM = 0
+FORMAT_ADPCM = 1
+FORMAT_ULAW = 2
+
+HEADER = "<4sBBHI"
+HEADER_SIZE = 12
+
+
+def sample_count(data_format, size):
+    """
+    Number of samples in audio data of given format and size in bytes.
+    """
+    if data_format == FORMAT_PCM:
+        return size//2
+    elif data_format == FORMAT_ADPCM:
+        return size*2
+    return size
+
+
+def data_size(data_format, count):
+    """
+    Size in bytes of audio data of given format and sample count.
+    """
+    if data_format == FORMAT_PCM:
+        return count*2
+    elif data_format == FORMAT_ADPCM:
+        return (count + 1)//2
+    return count
+
+
+def read_index_header(stream):
+    """
+    Read header of a sidecar index.
+    :return: flags and entry count
+    """
+    magic, version, flags, count = struct.unpack(INDEX_HEADER, stream.read(INDEX_HEADER_SIZE))
+    if magic != INDEX_MAGIC:
+        raise ValueError("not a diphone index")
+    if version > INDEX_VERSION:
+        raise ValueError(f"unsupported index version {version}")
+    return flags, count
+
+
+class Index:
+    def __init__(self, stream):
+        """
+        Read a sidecar index.
+        """
+        self.flags, count = read_index_header(stream)
+
+        table = stream.read()
+        self.sorted_keys = []
+        self.samples = array.array("I")
+        self.heads = array.array("H")
+        self.tails = array.array("H")
+        pos = 0
+        for _ in range(count):
+            key_len = table[pos]
+            self.sorted_keys.append(bytes(table[pos+1:pos+1+key_len]))
+            pos += 1 + key_len
+            samples, head, tail = struct.unpack_from("<IHH", table, pos)
+            pos += 8
+            self.samples.append(samples)
+            self.heads.append(head)
+            self.tails.append(tail)
+
+
+    def find(self, key):
+        """
+        Binary search of the key table.
+        :return: index of the key or -1 if it is missing
+        """
+        keys = self.sorted_keys
+        lo = 0
+        hi = len(keys)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if keys[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(keys) and keys[lo] == key:
+            return lo
+        return -1
+
+
+class Store(Index):
+    def __init__(self, stream):
+        """
+        Read header and key table of the store.
+        """
+        self.stream = stream
+        stream.seek(0)
+        magic, version, self.format, count, self.data_start = struct.unpack(HEADER, stream.read(HEADER_SIZE))
+        if magic != MAGIC:
+            raise ValueError("not a diphone store")
+        if version > VERSION:
+            raise ValueError(f"unsupported store version {version}")
+
+        table = stream.read(self.data_start - HEADER_SIZE)
+        self.sorted_keys = []
+        self.offsets = array.array("I")
+        self.sizes = array.array("I")
+        self.samples = array.array("I")
+        self.heads = array.array("H")
+        self.tails = array.array("H")
+        pos = 0
+        for _ in range(count):
+            key_len = table[pos]
+            self.sorted_keys.append(bytes(table[pos+1:pos+1+key_len]))
+            pos += 1 + key_len
+            offset, size = struct.unpack_from("<II", table, pos)
+            self.offsets.append(offset)
+            self.sizes.append(size)
+            pos += 8
+            if version >= 2:
+                self.samples.append(struct.unpack_from("<I", table, pos)[0])
+                pos += 4
+            else:
+                self.samples.append(sample_count(self.format, size))
+            if version >= 3:
+                head, tail = struct.unpack_from("<HH", table, pos)
+                pos += 4
+            else:
+                head = tail = 0
+            self.heads.append(head)
+            self.tails.append(tail)
+        self.flags = 0
+        for i in range(count):
+            if self.heads[i] or self.tails[i]:
+                self.flags = INDEX_JOINS
+                break
+
+
+    def read(self, index):
+        self.stream.seek(self.data_start + self.offsets[index])
+        return self.stream.read(self.sizes[index])
+
+
+    def __getitem__(self, key):
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.read(index)
+
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+
+    def __iter__(self):
+        return iter(self.sorted_keys)
+
+
+    def keys(self):
+        return iter(self.sorted_keys)
+
+
+    def items(self):
+        # Key order, like btree
+        for index in range(len(self.sorted_keys)):
+            yield self.sorted_keys[index], self.read(index)
+
+
+    def close(self):
+        self.sorted_keys = []
+
+
+def table_size(keys):
+    """
+    Size in bytes of header and key table of a store with given keys,
+    audio data starts at this file offset.
+    """
+    return HEADER_SIZE + sum(17 + len(k) for k in keys)
+
+
+def write_store(filename, entries, data_format, order=None, samples=None, joins=None):
+    """
+    Write a diphone store.
+    :param entries: dict mapping diphone key (bytes) to stored audio
+    :param data_format: FORMAT_PCM, FORMAT_ADPCM or FORMAT_ULAW
+    :param order: keys in the order their audio is laid out in the file,
+                  keys not listed follow in key order
+    :param samples: dict mapping diphone key to its decoded sample count,
+                    computed from data size by default
+    :param joins: dict mapping diphone key to (head, tail) join offsets,
+                  zero by default
+    """
+    keys = sorted(entries)
+    layout = []
+    if order is not None:
+        layout.extend(k for k in order if k in entries)
+    placed = set(layout)
+    layout.extend(k for k in keys if k not in placed)
+
+    offsets = {}
+    offset = 0
+    for key in layout:
+        offsets[key] = offset
+        offset += len(entries[key])
+
+    data_start = table_size(keys)
+    with open(filename, "wb") as f:
+        f.write(struct.pack(HEADER, MAGIC, VERSION, data_format, len(keys), data_start))
+        for key in keys:
+            f.write(bytes((len(key),)))
+            f.write(key)
+            if samples is not None:
+                count = samples[key]
+            else:
+                count = sample_count(data_format, len(entries[key]))
+            head, tail = joins.get(key, (0, 0)) if joins is not None else (0, 0)
+            f.write(struct.pack("<IIIHH", offsets[key], len(entries[key]), count, head, tail))
+        for key in layout:
+            f.write(entries[key])
+
+
+def write_index(filename, samples, joins=None):
+    """
+    Write a sidecar index of a btree database.
+    :param samples: dict mapping diphone key (bytes) to its decoded sample count
+    :param joins: dict mapping diphone key to (head, tail) join offsets,
+                  zero by default
+    """
+    keys = sorted(samples)
+    flags = 0
+    if joins is not None:
+        for head, tail in joins.values():
+            if head or tail:
+                flags = INDEX_JOINS
+    with open(filename, "wb") as f:
+        f.write(struct.pack(INDEX_HEADER, INDEX_MAGIC, INDEX_VERSION, flags, len(keys)))
+        for key in keys:
+            head, tail = joins.get(key, (0, 0)) if joins is not None else (0, 0)
+            f.write(bytes((len(key),)))
+            f.write(key)
+            f.write(struct.pack("<IHH", samples[key], head, tail))
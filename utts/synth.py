@@ -1,12 +1,53 @@
-import btree
 import struct
 import array
-import re
 
 try:
-    import adpcm
+    import micropython
+    import btree
+    from time import ticks_ms, ticks_diff
 except ImportError:
-    print("Warning: adpcm module missing. Some features will be unavailable.")
+    # CPython host, see utts/host.py
+    from . import compat as micropython
+    from . import bdb as btree
+    from .compat import ticks_ms, ticks_diff, const, ptr8, ptr16
+
+from . import store
+from .cache import CacheBudget, Cache
+
+# adpcm is imported on first use of a compressed database
+adpcm = None
+
+# Approximate bytes of a short str object and its list slot in the RAM key table
+RAM_KEY_OVERHEAD = 16
+
+
+def import_adpcm():
+    global adpcm
+    if adpcm is None:
+        try:
+            import adpcm
+        except ImportError:
+            print("Warning: adpcm module missing. Some features will be unavailable.")
+
+
+def ulaw_table():
+    """
+    Build G.711 u-law to 16-bit PCM decoding table.
+    """
+    table = array.array("h", [0]*256)
+    for code in range(256):
+        u = ~code & 0xff
+        exponent = (u >> 4) & 0x07
+        sample = ((((u & 0x0f) << 3) + 0x84) << exponent) - 0x84
+        table[code] = -sample if u & 0x80 else sample
+    return table
+
+
+def strip_silence(diphone):
+    """
+    Delete silence specification in string form (for now...)
+    """
+    return diphone.replace('2', '').replace('4', '')
 
 
 class Synth:
@@ -14,29 +55,355 @@ class Synth:
     BITS_PER_SAMPLE = 16
     NUM_CHANNELS = 1
     
-    def __init__(self, diphones_db, compressed=False):
+    def __init__(self, diphones_db, compressed=False, in_ram=False, keep_compressed=True, cache_size=0, budget=None, owner=None):
         """
-        Initialize synthesizer.
+        Initialize synthesizer. The database is opened on first use.
+        :param diphones_db: btree database or flat store (see utts.store)
+        :param compressed: btree database holds ADPCM audio, flat stores give their format in the header
+        :param in_ram: load the whole diphone inventory into RAM at startup
+        :param keep_compressed: keep ADPCM or u-law audio compressed in RAM and decode on demand
+        :param cache_size: RAM budget in bytes for decoded diphones kept between utterances
+        :param budget: CacheBudget shared with other caches, used instead of cache_size,
+                       the in_ram inventory is accounted to it as well
+        :param owner: name the memory is accounted to in the budget, diphones_db by default
         """
-        self.dbfile = open(diphones_db, "rb")
-        self.db = btree.open(self.dbfile, cachesize=1024)
-        self.db_compressed = compressed
+        self.diphones_db = diphones_db
+        self.owner = owner if owner is not None else diphones_db
+        self.db = None
+        self.db_format = store.FORMAT_ADPCM if compressed else store.FORMAT_PCM
+        self.ulaw_table = None
+        self.index = None
+        self.joins = None
+        self.fallbacks = {}
+        self.stats = {}
+        
+        self.shared_budget = budget is not None
+        self.budget = budget if budget is not None else CacheBudget(cache_size)
+        self.cache = Cache(self.budget, self.owner)
+        
+        self.ram_keys = None
+        self.ram_joins = None
+        if in_ram:
+            self.load_to_ram(keep_compressed)
     
     
     def __del__(self):
-        self.db.close()
-        self.dbfile.close()
+        self.close()
+    
+    
+    def open_db(self):
+        """
+        Open the diphone database if it is not open yet.
+        """
+        if self.db is None:
+            self.dbfile = open(self.diphones_db, "rb")
+            if self.dbfile.read(4) == store.MAGIC:
+                # Flat store, audio format is given by its header
+                self.db = store.Store(self.dbfile)
+                self.db_format = self.db.format
+            else:
+                self.dbfile.seek(0)
+                self.db = btree.open(self.dbfile, cachesize=1024)
+            if self.db_format == store.FORMAT_ADPCM:
+                self.load_adpcm()
+            elif self.db_format == store.FORMAT_ULAW and self.ulaw_table is None:
+                self.ulaw_table = ulaw_table()
+    
+    
+    def load_index(self):
+        """
+        Load sample counts and join offsets of the diphones without
+        reading audio: the key table of a flat store or the sidecar
+        index of a btree database (see utts.store).
+        :return: store.Index or None if a btree database has no index
+        """
+        if self.index is None:
+            self.index = False
+            try:
+                with open(self.diphones_db + store.INDEX_SUFFIX, "rb") as f:
+                    self.index = store.Index(f)
+            except OSError:
+                if self.db is None:
+                    # Look at the magic only, a btree is not opened for nothing
+                    with open(self.diphones_db, "rb") as f:
+                        if f.read(4) == store.MAGIC:
+                            self.open_db()
+                if isinstance(self.db, store.Store):
+                    self.index = self.db
+        return self.index or None
+    
+    
+    def has_joins(self):
+        """
+        Return True if the database carries join offsets.
+        Checked once, from the index header where possible.
+        """
+        if self.ram_keys is not None:
+            return self.ram_joins is not None
+        if self.joins is None:
+            try:
+                # The header is enough, the key table is loaded when offsets are needed
+                with open(self.diphones_db + store.INDEX_SUFFIX, "rb") as f:
+                    flags = store.read_index_header(f)[0]
+            except OSError:
+                table = self.load_index()
+                flags = table.flags if table is not None else 0
+            self.joins = (flags & store.INDEX_JOINS) != 0
+        return self.joins
+    
+    
+    def load_adpcm(self):
+        """
+        Import ADPCM decoder on first use of a compressed database.
+        """
+        import_adpcm()
+    
+    
+    def close(self):
+        """
+        Close the diphone database. It will be reopened on next use.
+        """
+        if self.db is not None:
+            if self.index is self.db:
+                self.index = None
+            self.db.close()
+            self.dbfile.close()
+            self.db = None
+    
+    
+    def cache_put(self, diphone, audio, oldest=False):
+        """
+        Keep decoded diphone audio in the cache, least recently
+        used diphones are evicted when the budget is full.
+        :param oldest: add it as least recently used, without evicting (see utts.snapshot)
+        """
+        if diphone in self.cache:
+            return
+        if not isinstance(audio, array.array):
+            audio = array.array("h", audio)
+        self.cache.put(diphone, audio, len(audio)*2, oldest)
+    
+    
+    def drop_cache(self):
+        """
+        Free cached diphones and return their memory to the budget.
+        """
+        self.cache.clear()
+    
+    
+    def reserve_resident(self, nbytes):
+        """
+        Account RAM of the in_ram inventory to a shared budget.
+        Raises MemoryError if it does not fit.
+        """
+        if self.shared_budget and not self.budget.reserve(self.owner, nbytes):
+            raise MemoryError(f"{self.diphones_db} needs {nbytes} bytes resident, more than left in the budget")
+    
+    
+    def resident_size(self, keep_compressed=True):
+        """
+        Return bytes load_to_ram() keeps resident, computed from
+        the index without reading audio.
+        Raises ValueError if a btree database has no sidecar index.
+        """
+        table = self.load_index()
+        if table is None:
+            raise ValueError(f"{self.diphones_db} has no sample index, create it with db/index_db.py")
+        data_format = table.format if isinstance(table, store.Store) else self.db_format
+        nbytes = 0
+        for count in table.samples:
+            if data_format != store.FORMAT_PCM and keep_compressed:
+                nbytes += store.data_size(data_format, count)
+            else:
+                nbytes += count*2
+        return nbytes + self.table_size(table.sorted_keys, table.flags & store.INDEX_JOINS)
+    
+    
+    @staticmethod
+    def table_size(keys, joins):
+        """
+        Bytes of the RAM key table, offset array and join offsets.
+        Key strings are counted with an estimated object overhead.
+        """
+        nbytes = (len(keys) + 1)*4
+        for key in keys:
+            nbytes += len(key) + RAM_KEY_OVERHEAD
+        if joins:
+            nbytes += len(keys)*4
+        return nbytes
+    
+    
+    def ram_samples(self, raw_audio):
+        """
+        Return decoded audio to append to the RAM buffer.
+        """
+        if self.db_format == store.FORMAT_PCM:
+            # Little-endian bytes are taken as they are
+            return array.array("h", raw_audio)
+        return array.array("h", self.decode(raw_audio))
+    
+    
+    def load_to_ram(self, keep_compressed=True):
+        """
+        Load the whole diphone inventory into one contiguous
+        buffer with a sorted key table and an offset array,
+        then close the database file.
+        With a shared budget the size is reserved from the index
+        first, so an inventory that does not fit is refused
+        with MemoryError before anything is loaded.
+        """
+        start = ticks_ms()
+        self.ram_keys = None
+        joins = self.has_joins()
+        reserved = 0
+        if self.shared_budget:
+            reserved = self.resident_size(keep_compressed)
+            self.reserve_resident(reserved)
+        try:
+            self.open_db()
+            
+            self.ram_compressed = self.db_format != store.FORMAT_PCM and keep_compressed
+            if self.ram_compressed:
+                # ADPCM or u-law bytes, decoded on each lookup
+                self.ram_audio = bytearray()
+            else:
+                # 16-bit samples
+                self.ram_audio = array.array("h")
+            self.ram_keys = []
+            self.ram_offsets = array.array("I", [0])
+            
+            # Databases iterate in key order, so the key table comes out sorted
+            for key, raw_audio in self.db.items():
+                self.ram_keys.append(str(key, "ascii"))
+                if self.ram_compressed:
+                    self.ram_audio.extend(raw_audio)
+                else:
+                    self.ram_audio.extend(self.ram_samples(raw_audio))
+                self.ram_offsets.append(len(self.ram_audio))
+            self.ram_view = memoryview(self.ram_audio)
+            
+            # Join offsets of the index share the order of the key table
+            self.ram_joins = None
+            if joins:
+                table = self.load_index()
+                if len(table.sorted_keys) == len(self.ram_keys):
+                    self.ram_joins = (table.heads, table.tails)
+        except Exception:
+            self.ram_keys = None
+            self.ram_audio = None
+            self.budget.release(self.owner, reserved)
+            raise
+        
+        self.close()
+        # The RAM key table replaces the index
+        self.index = None
+        
+        itemsize = 1 if self.ram_compressed else 2
+        self.stats["load_ms"] = ticks_diff(ticks_ms(), start)
+        self.stats["resident_bytes"] = len(self.ram_audio)*itemsize + self.table_size(self.ram_keys, self.ram_joins is not None)
+        print(f"Loaded {len(self.ram_keys)} diphones in {self.stats['load_ms']} ms, {self.stats['resident_bytes']} bytes resident")
+    
+    
+    @micropython.native
+    def find_key(self, diphone):
+        """
+        Binary search of the RAM key table.
+        :return: index of the diphone or -1 if it is missing
+        """
+        keys = self.ram_keys
+        lo = 0
+        hi = len(keys)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if keys[mid] < diphone:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(keys) and keys[lo] == diphone:
+            return lo
+        return -1
+    
+    
+    def diphone_keys(self):
+        """
+        Iterate over all diphone keys in the inventory.
+        """
+        if self.ram_keys is not None:
+            return iter(self.ram_keys)
+        self.open_db()
+        return (str(k, "ascii") for k in self.db.keys())
+    
+    
+    def index_keys(self):
+        """
+        Iterate over all diphone keys of the RAM key table or the
+        index, without opening a btree database.
+        """
+        if self.ram_keys is not None:
+            return iter(self.ram_keys)
+        table = self.load_index()
+        if table is None:
+            raise ValueError(f"{self.diphones_db} has no sample index, create it with db/index_db.py")
+        return (str(k, "ascii") for k in table.sorted_keys)
     
     
     def get_diphone(self, diphone):
+        if self.ram_keys is not None:
+            index = self.find_key(diphone)
+            if index < 0:
+                raise KeyError(diphone)
+            audio = self.ram_view[self.ram_offsets[index]:self.ram_offsets[index+1]]
+            if self.ram_compressed:
+                return self.decode(audio)
+            return audio
+        
+        audio = self.cache.get(diphone)
+        if audio is not None:
+            return audio
+        
+        self.open_db()
         key = bytes(diphone, "ascii")
-        raw_audio = self.db[key]
-        if not self.db_compressed:
-            return struct.unpack(f"<{len(raw_audio)//2}h", raw_audio)
+        audio = self.decode(self.db[key])
+        if self.budget.size:
+            self.cache_put(diphone, audio)
+        return audio
+    
+    
+    def decode(self, raw_audio):
+        """
+        Decode audio stored in the database into samples.
+        """
+        if self.db_format == store.FORMAT_PCM:
+            return self.unpack_pcm(raw_audio)
+        elif self.db_format == store.FORMAT_ULAW:
+            return self.unpack_ulaw(raw_audio)
         else:
             return self.unpack_adpcm(raw_audio)
     
     
+    @staticmethod
+    def unpack_pcm(raw_audio):
+        return struct.unpack(f"<{len(raw_audio)//2}h", raw_audio)
+    
+    
+    def unpack_ulaw(self, raw_audio):
+        # MicroPython creates the array from raw bytes, so it is zero-filled
+        decoded_audio = array.array("h", bytearray(len(raw_audio)*2))
+        self.ulaw_decode(raw_audio, decoded_audio, self.ulaw_table)
+        return decoded_audio
+    
+    
+    @micropython.viper
+    @staticmethod
+    def ulaw_decode(raw_audio:object, decoded_audio:object, table:object):
+        raw_audio_len = int(len(raw_audio))
+        raw_audio_ptr = ptr8(raw_audio)
+        decoded_audio_ptr = ptr16(decoded_audio)
+        table_ptr = ptr16(table)
+        for i in range(raw_audio_len):
+            decoded_audio_ptr[i] = table_ptr[raw_audio_ptr[i]]
+    
+    
     @micropython.viper
     @staticmethod
     def unpack_adpcm(raw_audio:object) -> object:
@@ -94,37 +461,91 @@ class Synth:
         self.output_audios.append(silence_arr)
     
     
+    @micropython.native
+    def prefetch(self, diphones):
+        """
+        Read every distinct diphone of the utterance once,
+        in sorted key order, so the btree is swept almost
+        sequentially instead of being hit in spoken order.
+        Flat stores are read in the order of their audio data.
+        Missing keys are resolved to emergency diphones
+        in the same pass.
+        :param diphones: diphone list from Utterance.get_diphones()
+        :return: dict mapping diphone key to audio (None if unresolved)
+        """
+        keys = {}
+        for diphone in diphones:
+            keys[strip_silence(diphone)] = None
+        
+        order = sorted(keys)
+        if self.ram_keys is None:
+            for key in order:
+                if key not in self.cache:
+                    self.open_db()
+                    break
+            if isinstance(self.db, store.Store):
+                # Audio may be laid out in any order (see db/optimize_layout.py)
+                offsets = []
+                for key in order:
+                    index = self.db.find(bytes(key, "ascii"))
+                    offsets.append((self.db.offsets[index] if index >= 0 else 0, key))
+                offsets.sort()
+                order = [key for offset, key in offsets]
+        
+        fetched = {}
+        for key in order:
+            if key in fetched:
+                # Already read as a fallback for an earlier key
+                continue
+            try:
+                fetched[key] = self.get_diphone(key)
+            except KeyError:
+                print(f"{key} don't exist in database")
+                
+                # Attempt an emergency key search
+                backupkey = self.find_fallback(key)
+                
+                if backupkey is None:
+                    fetched[key] = None
+                elif backupkey in fetched:
+                    fetched[key] = fetched[backupkey]
+                else:
+                    fetched[key] = fetched[backupkey] = self.get_diphone(backupkey)
+        
+        return fetched
+    
+    
     @micropython.native
     def synthesize(self, diphones, crossfade=0):
+        start = ticks_ms()
+        
+        # Fetch all audio for the utterance before assembling it
+        fetched = self.prefetch(diphones)
+        
         # Create audio sequence from diphones
         self.output_audios = []
+        use_joins = self.has_joins()
+        self.output_joins = [] if use_joins else None
+        joins = {}
         
         for diphone in diphones:
             self.silence_length = 0
             
-            try:
-                # Delete silence specification in string form (for now...)
-                key_no_sil = re.sub('[24]', '', diphone)
-
-                # Find the diphone in db
-                audio = self.get_diphone(key_no_sil)
-                
-                # put audio data into the bytearray
-                self.output_audios.append(audio)
-            except KeyError:
-                print(f"{diphone} don't exist in database")
-
-                # Attempt an emergency key search
-                backupkey = self.emergency_diphone(diphone)
-                
-                if backupkey is None:
-                    continue
-
-                # Find the diphone in db
-                audio = self.get_diphone(backupkey)
-                
-                # put audio data into the bytearray
-                self.output_audios.append(audio)
+            # Find the diphone among prefetched ones
+            key = strip_silence(diphone)
+            audio = fetched[key]
+            
+            if audio is None:
+                continue
+            
+            # put audio data into the bytearray
+            self.output_audios.append(audio)
+            
+            if use_joins:
+                join = joins.get(key)
+                if join is None:
+                    join = joins[key] = self.join_offsets(self.fallbacks.get(key, key))
+                self.output_joins.append(join)
 
             # investigate if a pau item had
             if diphone[-1] == '2':
@@ -138,28 +559,196 @@ class Synth:
             # append silence to the list if a value was added to variable self.silence_length during loop
             if self.silence_length != 0:
                 self.add_silence()
+                if use_joins:
+                    self.output_joins.append((0, 0))
         
         # join audio data chunks into one waveform
-        self.output_audio = array.array("h", [])
-        if crossfade > 0:
-            window_len = int(crossfade*self.SAMPLE_RATE)
-        for audio in self.output_audios:
-            if crossfade > 0:
-                self.crossfade(self.output_audio, audio, window_len)
+        self.output_audio = self.concatenate(self.output_audios, crossfade, self.output_joins)
+        
+        end = ticks_ms()
+        self.stats["synth_ms"] = ticks_diff(end, start)
+        self.stats["samples"] = len(self.output_audio)
+        if "first_sample_ms" not in self.stats:
+            # ticks count from boot, so this is time-to-first-sample after a wake
+            self.stats["first_sample_ms"] = end
+    
+    
+    def sample_count(self, diphone):
+        """
+        Return number of samples of the diphone without reading its audio.
+        Raises KeyError if the diphone is missing and ValueError
+        if a btree database has no sidecar index.
+        """
+        if self.ram_keys is not None:
+            index = self.find_key(diphone)
+            if index < 0:
+                raise KeyError(diphone)
+            count = self.ram_offsets[index+1] - self.ram_offsets[index]
+            if self.ram_compressed:
+                count = store.sample_count(self.db_format, count)
+            return count
+        
+        audio = self.cache.get(diphone)
+        if audio is not None:
+            return len(audio)
+        
+        table = self.load_index()
+        if table is None:
+            raise ValueError(f"{self.diphones_db} has no sample index, create it with db/index_db.py")
+        index = table.find(bytes(diphone, "ascii"))
+        if index < 0:
+            raise KeyError(diphone)
+        return table.samples[index]
+    
+    
+    def unit_info(self, key, joins=True):
+        """
+        Return (sample count, head, tail) of the diphone or its
+        emergency replacement, sample count is -1 if neither exists.
+        :param joins: look up join offsets, otherwise they are zero
+        """
+        try:
+            count = self.sample_count(key)
+        except KeyError:
+            # Search the index, get_duration() must not open the database
+            key = self.find_fallback(key, self.index_keys)
+            if key is None:
+                return (-1, 0, 0)
+            count = self.sample_count(key)
+        if joins:
+            return (count,) + self.join_offsets(key)
+        return (count, 0, 0)
+    
+    
+    def get_duration(self, diphones, crossfade=0):
+        """
+        Return exact number of samples synthesize() would produce
+        for the diphone list, without reading any audio.
+        Divide by SAMPLE_RATE to get seconds.
+        """
+        window_len = int(crossfade*self.SAMPLE_RATE) if crossfade > 0 else 0
+        joins = self.has_joins()
+        units = {}
+        chunks = []
+        for diphone in diphones:
+            key = strip_silence(diphone)
+            unit = units.get(key)
+            if unit is None:
+                unit = units[key] = self.unit_info(key, joins)
+            if unit[0] < 0:
+                continue
+            
+            chunks.append(unit)
+            if diphone[-1] == '2':
+                chunks.append((int(0.2*self.SAMPLE_RATE), 0, 0))
+            if diphone[-1] == '4':
+                chunks.append((int(0.4*self.SAMPLE_RATE), 0, 0))
+        
+        # same arithmetic as concatenate() and crossfade()
+        last = len(chunks) - 1
+        while last > 0 and chunks[last][0] == 0:
+            last -= 1
+        total = 0
+        for i in range(len(chunks)):
+            count, head, tail = chunks[i]
+            if count > 0:
+                start = min(head, count) if total > 0 else 0
+                end = count - tail if i < last else count
+                if end < start:
+                    end = start
+                count = end - start
+            total += count - min(window_len, total, count)
+        return total
+    
+    
+    def estimate_latency(self, diphones, crossfade=0):
+        """
+        Estimate in milliseconds how long synthesize() will take,
+        scaled from the last measured synthesis speed.
+        :return: estimated time or None if nothing was synthesized yet
+        """
+        if not self.stats.get("samples"):
+            return None
+        return self.stats["synth_ms"] * self.get_duration(diphones, crossfade) // self.stats["samples"]
+    
+    
+    def join_offsets(self, diphone):
+        """
+        Return (head, tail) join offsets of the diphone: numbers of
+        near-silent samples kept at its ends when it was trimmed.
+        They come from the index, without one they are zero.
+        """
+        if self.ram_keys is not None:
+            if self.ram_joins is None:
+                return (0, 0)
+            index = self.find_key(diphone)
+            heads, tails = self.ram_joins
+        else:
+            if not self.has_joins():
+                return (0, 0)
+            table = self.load_index()
+            index = table.find(bytes(diphone, "ascii"))
+            heads, tails = table.heads, table.tails
+        if index < 0:
+            raise KeyError(diphone)
+        return (heads[index], tails[index])
+    
+    
+    @micropython.native
+    def concatenate(self, audios, crossfade=0, joins=None):
+        """
+        Join audio chunks into one waveform,
+        crossfading them if crossfade (in seconds) is given.
+        Join offsets mark cut points: the near-silent tail and
+        head of neighbouring chunks are dropped before joining.
+        """
+        output_audio = array.array("h", [])
+        window_len = int(crossfade*self.SAMPLE_RATE) if crossfade > 0 else 0
+        # Tail of the last chunk is kept, so find it first
+        last = len(audios) - 1
+        while last > 0 and len(audios[last]) == 0:
+            last -= 1
+        for i in range(len(audios)):
+            audio = audios[i]
+            if joins is not None and len(audio) > 0:
+                head, tail = joins[i]
+                count = len(audio)
+                start = min(head, count) if len(output_audio) > 0 else 0
+                end = count - tail if i < last else count
+                if end < start:
+                    end = start
+                audio = memoryview(audio)[start:end]
+            if window_len > 0:
+                self.crossfade(output_audio, audio, window_len)
             else:
-                self.output_audio.extend(audio)
+                output_audio.extend(audio)
+        return output_audio
+    
+    
+    def find_fallback(self, lostkey, keys=None):
+        """
+        Return emergency diphone for a missing key,
+        remembering the result for later utterances.
+        :param keys: function iterating over the keys to search, diphone_keys() by default
+        """
+        if lostkey not in self.fallbacks:
+            self.fallbacks[lostkey] = self.emergency_diphone(lostkey, keys)
+        return self.fallbacks[lostkey]
     
     
     @micropython.native
-    def emergency_diphone(self, lostkey):
+    def emergency_diphone(self, lostkey, keys=None):
         """
         Select an emergency diphone by using regex, this
         function will look through the dictionary's keys
         to find a key that is a near orthographic match
         to the lost key
         :param lostkey a key not in the dictionary
+        :param keys: function iterating over the keys to search, diphone_keys() by default
         :return: a new key to search
         """
+        import re
+        
         # Find the midpoint of the current diphone key
         midpoint = lostkey.find('-')
 
@@ -186,8 +775,7 @@ class Synth:
                 break
 
             # Search for the ideal key in the diphones dictionary
-            for k in self.db.keys():
-                k = str(k, "ascii")
+            for k in (keys or self.diphone_keys)():
                 if re.match(ideal_key, k):
                     print(f"using '{k}' instead")
                     return k
@@ -1,7 +1,15 @@
-import micropython
-import btree
 import re
 
+from .cache import CacheBudget, Cache
+
+try:
+    import micropython
+    import btree
+except ImportError:
+    # CPython host, see utts/host.py
+    from . import compat as micropython
+    from . import bdb as btree
+
 LEXICON_ALPHABET = micropython.const((
                           "AA", "AA0", "AA1", "AA2", "AE", "AE0", "AE1", "AE2", "AH", "AH0", "AH1", "AH2", "AO",
                           "AO0", "AO1", "AO2", "AW", "AW0", "AW1", "AW2", "AY", "AY0", "AY1", "AY2", "B", "CH",
@@ -47,29 +55,116 @@ MONTHS = micropython.const(("",
           "december"))
 
 
+class Lexicon:
+    def __init__(self, lexicon_db, cache_size=0, budget=None):
+        """
+        Lexicon database handle with a cache of raw entries,
+        can be shared by several utterances.
+        The database is opened on first use.
+        :param cache_size: RAM budget in bytes for lexicon entries kept between utterances
+        :param budget: CacheBudget shared with other caches, used instead of cache_size
+        """
+        self.lexicon_db = lexicon_db
+        self.db = None
+        
+        self.budget = budget if budget is not None else CacheBudget(cache_size)
+        self.cache = Cache(self.budget, lexicon_db)
+    
+    
+    def __del__(self):
+        self.close()
+    
+    
+    def open_db(self):
+        """
+        Open the lexicon database if it is not open yet.
+        """
+        if self.db is None:
+            self.dbfile = open(self.lexicon_db, "rb")
+            self.db = btree.open(self.dbfile)
+    
+    
+    def close(self):
+        """
+        Close the lexicon database. It will be reopened on next use.
+        """
+        if self.db is not None:
+            self.db.close()
+            self.dbfile.close()
+            self.db = None
+    
+    
+    def cache_put(self, word, entry, oldest=False):
+        """
+        Keep a raw lexicon entry in the cache, least recently
+        used entries are evicted when the budget is full.
+        :param oldest: add it as least recently used, without evicting (see utts.snapshot)
+        """
+        self.cache.put(word, entry, len(word) + len(entry), oldest)
+    
+    
+    def drop_cache(self):
+        """
+        Free cached entries and return their memory to the budget.
+        """
+        self.cache.clear()
+    
+    
+    def lookup(self, word):
+        """
+        Return raw lexicon entry of the word.
+        Raises KeyError if the word is not in the lexicon.
+        """
+        entry = self.cache.get(word)
+        if entry is None:
+            self.open_db()
+            entry = self.db[bytes(word, "ascii")]
+            if self.budget.size:
+                self.cache_put(word, entry)
+        return entry
+
+
 class Utterance:
-    def __init__(self, lexicon_db):
+    def __init__(self, lexicon_db, cache_size=0):
         """
-        Initialize utterance.
+        Initialize utterance. The lexicon is opened on first use.
+        :param lexicon_db: lexicon database file name or a shared Lexicon
+        :param cache_size: RAM budget in bytes for lexicon entries kept between utterances
         """
         self.phrase = None
         self.diphonelist = []
         
-        self.dbfile = open(lexicon_db, "rb")
-        self.db = btree.open(self.dbfile)
+        if isinstance(lexicon_db, Lexicon):
+            self.lexicon = lexicon_db
+        else:
+            self.lexicon = Lexicon(lexicon_db, cache_size)
     
     
-    def __del__(self):
-        self.db.close()
-        self.dbfile.close()
-        
+    @property
+    def cache(self):
+        return self.lexicon.cache
+    
+    
+    def close(self):
+        """
+        Close the lexicon database. It will be reopened on next use.
+        """
+        self.lexicon.close()
+    
+    
+    def cache_put(self, word, entry, oldest=False):
+        self.lexicon.cache_put(word, entry, oldest)
+    
+    
+    def lookup(self, word):
+        return self.lexicon.lookup(word)
+    
     
     #@micropython.native
     def pron_variants(self, word):
         variants = []
         current_variant = []
-        key = bytes(word, "ascii")
-        for byte in self.db[key]:
+        for byte in self.lookup(word):
             if byte == 0:
                 variants.append(current_variant)
                 current_variant = []